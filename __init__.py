@@ -26,8 +26,11 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from threading import Thread, Event
-from typing import List, Optional
+import re
+from functools import lru_cache
+from itertools import chain
+from threading import Thread, Event, Lock
+from typing import List, Optional, Tuple
 from os.path import join, dirname, expanduser, isdir
 from random import sample
 
@@ -39,16 +42,26 @@ from ovos_utils.log import LOG
 from ovos_utils.process_utils import RuntimeRequirements
 from ovos_utils.xdg_utils import xdg_cache_home
 
-from skill_local_music.util import MusicLibrary, Track
+from skill_local_music.util import MusicLibrary, Track, debug_enabled
 
 
 class LocalMusicSkill(OVOSCommonPlaybackSkill):
+    # Base match confidence for each search category
+    _base_scores = {'artist': 65, 'album': 70, 'genre': 50, 'track': 75}
+
     def __init__(self, **kwargs):
         self.supported_media = [MediaType.MUSIC,
                                 MediaType.AUDIO,
                                 MediaType.GENERIC]
         self.library_update_event = Event()
+        self._update_lock = Lock()
+        self._updating = False
+        self._update_pending = False
         self._music_library = None
+        # (configured value, expanded path) for `music_dir`
+        self._music_dir = (None, None)
+        self._search_cache = lru_cache(maxsize=256)(self._search_library)
+        self._local_voc = dict()
         self._image_url = join(dirname(__file__), 'ui/music-solid.svg')
         self._demo_dir = join(expanduser(xdg_cache_home()), "neon",
                               "demo_music")
@@ -72,11 +85,17 @@ class LocalMusicSkill(OVOSCommonPlaybackSkill):
 
     @property
     def music_dir(self) -> str:
-        return expanduser(self.settings.get('music_dir') or "~/Music")
+        configured = self.settings.get('music_dir') or "~/Music"
+        if configured != self._music_dir[0]:
+            self._music_dir = (configured, expanduser(configured))
+        return self._music_dir[1]
 
+    # Not a `cached_property`; skill init calls `getattr` on every
+    # non-property attribute, which would create the library before settings
+    # are applied
     @property
     def music_library(self):
-        if not self._music_library:
+        if self._music_library is None:
             LOG.info(f"Initializing music library at: {self.music_dir}")
             self._music_library = MusicLibrary(self.music_dir,
                                                self.file_system.path)
@@ -88,6 +107,26 @@ class LocalMusicSkill(OVOSCommonPlaybackSkill):
         Thread(target=self.update_library, daemon=True).start()
 
     def update_library(self):
+        with self._update_lock:
+            if self._updating:
+                LOG.debug("Library update already in progress")
+                self._update_pending = True
+                return
+            self._updating = True
+        try:
+            while True:
+                self._update_library()
+                # Re-scan once if another update was requested meanwhile
+                with self._update_lock:
+                    if not self._update_pending:
+                        break
+                    self._update_pending = False
+        finally:
+            with self._update_lock:
+                self._updating = False
+                self._update_pending = False
+
+    def _update_library(self):
         self.library_update_event.clear()
         if self.music_dir and isdir(self.music_dir):
             LOG.debug(f"Load configured directory: {self.music_dir}")
@@ -100,90 +139,144 @@ class LocalMusicSkill(OVOSCommonPlaybackSkill):
             LOG.info(f"Downloading Demo Music from: {self.demo_url}")
             self._download_demo_tracks()
         elif isdir(self._demo_dir):
-            self.music_library.update_library(self._demo_dir)
+            self.music_library.update_library(self._demo_dir, is_demo=True)
         self.library_update_event.set()
+        self._search_cache.cache_clear()
 
     @ocp_search()
     def search_music(self, phrase, media_type=MediaType.GENERIC):
+        if len(phrase.strip()) < 2:
+            LOG.debug(f"Ignoring short phrase: {phrase}")
+            return []
         if not self.library_update_event.wait(5):
             LOG.warning("Library update in progress; results may be limited")
-        results = self.search_artist(phrase, media_type) + \
-            self.search_album(phrase, media_type) + \
-            self.search_genre(phrase, media_type) + \
-            self.search_track(phrase, media_type)
-        if not results and self.voc_match(phrase, 'local.voc'):
+        is_local = self._is_local_phrase(phrase)
+        # A track may match more than one category; keep its best score
+        best_scores = dict()
+        for kind in self._base_scores:
+            tracks, score = self._search_tracks(kind, phrase, media_type,
+                                                is_local)
+            for track in tracks:
+                if track.path not in best_scores or \
+                        best_scores[track.path][1] < score:
+                    best_scores[track.path] = (track, score)
+        by_score = dict()
+        for track, score in best_scores.values():
+            by_score.setdefault(score, []).append(track)
+        results = list(chain.from_iterable(
+            self._tracks_to_search_results(tracks, score)
+            for score, tracks in sorted(by_score.items(), reverse=True)))
+        if not results and is_local:
             score = 60
             if media_type == MediaType.MUSIC:
                 score += 20
             else:
                 LOG.debug("No media type requested")
             all_songs = self.music_library.all_songs
-            non_demo = [s for s in all_songs
-                        if not s.path.startswith(self._demo_dir)]
+            non_demo = [s for s in all_songs if not s.is_demo]
             if non_demo:
                 LOG.debug("Using non-demo tracks")
                 all_songs = non_demo
             if len(all_songs) > 50:
-                all_songs = sample(self.music_library.all_songs, 50)
+                all_songs = sample(all_songs, 50)
             results = self._tracks_to_search_results(all_songs, score)
             LOG.info(f"Returning all songs with score={score}")
         LOG.info(f"Returning {len(results)} results")
         return results
 
-    def search_artist(self, phrase, media_type=MediaType.GENERIC) -> List[dict]:
-        score = 65
-        if media_type == MediaType.MUSIC:
-            score += 20
-        if self.voc_match(phrase, 'local.voc'):
-            score += 20
-        tracks = self.music_library.search_songs_for_artist(phrase)
-        LOG.debug(f"Found {len(tracks)} artist results")
-        return self._tracks_to_search_results(tracks, score)
+    def search_artist(self, phrase, media_type=MediaType.GENERIC,
+                      is_local: Optional[bool] = None) -> List[dict]:
+        return self._tracks_to_search_results(
+            *self._search_tracks('artist', phrase, media_type, is_local))
 
-    def search_album(self, phrase, media_type=MediaType.GENERIC) -> List[dict]:
-        score = 70
-        if media_type == MediaType.MUSIC:
-            score += 20
-        if self.voc_match(phrase, 'local.voc'):
-            score += 20
-        tracks = self.music_library.search_songs_for_album(phrase)
-        LOG.debug(f"Found {len(tracks)} album results")
-        return self._tracks_to_search_results(tracks, score)
+    def search_album(self, phrase, media_type=MediaType.GENERIC,
+                     is_local: Optional[bool] = None) -> List[dict]:
+        return self._tracks_to_search_results(
+            *self._search_tracks('album', phrase, media_type, is_local))
 
-    def search_genre(self, phrase, media_type=MediaType.GENERIC) -> List[dict]:
-        score = 50
-        if media_type == MediaType.MUSIC:
-            score += 20
-        if self.voc_match(phrase, 'local.voc'):
-            score += 20
-        tracks = self.music_library.search_songs_for_genre(phrase)
-        LOG.debug(f"Found {len(tracks)} genre results")
-        return self._tracks_to_search_results(tracks, score)
+    def search_genre(self, phrase, media_type=MediaType.GENERIC,
+                     is_local: Optional[bool] = None) -> List[dict]:
+        return self._tracks_to_search_results(
+            *self._search_tracks('genre', phrase, media_type, is_local))
+
+    def search_track(self, phrase, media_type=MediaType.GENERIC,
+                     is_local: Optional[bool] = None) -> List[dict]:
+        return self._tracks_to_search_results(
+            *self._search_tracks('track', phrase, media_type, is_local))
 
-    def search_track(self, phrase, media_type=MediaType.GENERIC) -> List[dict]:
-        score = 75
+    def _search_tracks(self, kind: str, phrase: str,
+                       media_type=MediaType.GENERIC,
+                       is_local: Optional[bool] = None) -> \
+            Tuple[Tuple[Track, ...], int]:
+        """
+        Search the music library for tracks matching `phrase` by `kind`
+        :param kind: one of `artist`, `album`, `genre`, `track`
+        :param phrase: search phrase
+        :param media_type: requested MediaType
+        :param is_local: True if the phrase requests local media; if None,
+            `phrase` is checked against `local.voc`
+        :returns: tuple of matching Tracks, match confidence for those Tracks
+        """
+        score = self._base_scores[kind]
         if media_type == MediaType.MUSIC:
             score += 20
-        if self.voc_match(phrase, 'local.voc'):
+        if is_local is None:
+            is_local = self._is_local_phrase(phrase)
+        if is_local:
             score += 20
-        tracks = self.music_library.search_songs_for_track(phrase)
-        LOG.debug(f"Found {len(tracks)} track results")
-        return self._tracks_to_search_results(tracks, score)
+        tracks = self._cached_search(kind, phrase)
+        if debug_enabled():
+            LOG.debug(f"Found {len(tracks)} {kind} results")
+        return tracks, score
+
+    def _is_local_phrase(self, phrase: str) -> bool:
+        """
+        Check if a phrase contains `local.voc` vocabulary. This matches like
+        `voc_match`, but compiles the vocabulary into a single pattern once
+        per language instead of building a regex per option on every call.
+        :param phrase: search phrase
+        :returns: True if the phrase requests local media
+        """
+        if self.lang not in self._local_voc:
+            vocab = self.voc_list('local.voc')
+            self._local_voc[self.lang] = \
+                re.compile(r'\b(?:' + '|'.join(vocab) + r')\b') \
+                if vocab else None
+        pattern = self._local_voc[self.lang]
+        return bool(phrase and pattern and pattern.search(phrase))
+
+    def _cached_search(self, kind: str, phrase: str) -> Tuple[Track, ...]:
+        """
+        Search the music library, reusing results for repeated phrases until
+        the library changes. Results are keyed by the library generation so
+        a search racing an update can't cache results for the old library.
+        :param kind: one of `artist`, `album`, `genre`, `track`
+        :param phrase: search phrase
+        :returns: tuple of matching Tracks
+        """
+        return self._search_cache(kind, phrase.casefold().strip(),
+                                  self.music_library.generation)
+
+    def _search_library(self, kind: str, phrase: str,
+                        generation: int) -> Tuple[Track, ...]:
+        search = getattr(self.music_library, f"search_songs_for_{kind}")
+        return tuple(search(phrase))
 
     def _tracks_to_search_results(self, tracks: List[Track], score: int = 20):
         # TODO: Lower confidence if path is in demo dir
-        tracks = [{'media_type': MediaType.MUSIC,
-                   'playback': PlaybackType.AUDIO,
-                   'image': track.artwork if track.artwork else None,
-                   'skill_icon': self._image_url,
+        base = {'media_type': MediaType.MUSIC,
+                'playback': PlaybackType.AUDIO,
+                'skill_icon': self._image_url,
+                'match_confidence': score}
+        tracks = [{**base,
+                   'image': track.artwork or None,
                    'uri': track.path,
                    'title': track.title,
                    'artist': track.artist,
-                   'length': track.duration_ms,
-                   'match_confidence': score} for track in tracks]
+                   'length': track.duration_ms} for track in tracks]
         return tracks
 
     def _download_demo_tracks(self):
         from ovos_skill_installer import download_extract_zip
         download_extract_zip(self.demo_url, self._demo_dir)
-        self.music_library.update_library(self._demo_dir)
+        self.music_library.update_library(self._demo_dir, is_demo=True)
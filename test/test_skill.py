@@ -27,8 +27,11 @@
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import pytest
+import struct
 
+from os import listdir, makedirs, remove, symlink
 from os.path import dirname, join, isfile, isdir
+from unittest.mock import patch
 from neon_minerva.tests.skill_unit_test_base import SkillTestCase
 
 
@@ -53,6 +56,7 @@ class TestSkillMethods(SkillTestCase):
         self.assertTrue(self.skill.library_update_event.wait())
 
     def test_music_library(self):
+        self.assertTrue(self.skill.library_update_event.wait())
         lib = self.skill.music_library
         self.assertIn(self.skill.music_dir, lib.library_paths)
         for lib_path in lib.library_paths:
@@ -63,6 +67,10 @@ class TestSkillMethods(SkillTestCase):
         self.assertEqual(lib.search_songs_for_artist("Artist 1 test"),
                          lib.search_songs_for_artist("artist 1"))
         self.assertEqual(len(lib.search_songs_for_artist('artist 1')), 4)
+        self.assertEqual(lib.search_songs_for_artist("artist 1 or artist 1"),
+                         lib.search_songs_for_artist("artist 1"))
+        self.assertEqual(len(lib.search_songs_for_album("album 1 album 1")),
+                         2)
         self.assertEqual(len(lib.search_songs_for_artist('artist')), 0)
         self.assertEqual(len(lib.search_songs_for_artist('theartist 1')), 0)
 
@@ -71,10 +79,27 @@ class TestSkillMethods(SkillTestCase):
         self.assertEqual(album_2[0].title, "Track 1")
         self.assertEqual(album_2[1].title, "Track two")
 
+        self.assertEqual(lib.search_songs_for_artist("ARTIST 1"),
+                         lib.search_songs_for_artist("artist 1"))
+
         track_1 = lib.search_songs_for_track('track one')
         self.assertEqual(len(track_1), 1)
         self.assertEqual(track_1[0].title, "Track one")
 
+    def test_cached_search(self):
+        self.assertTrue(self.skill.library_update_event.wait())
+        tracks = self.skill._cached_search('artist', "Artist 1 ")
+        self.assertEqual(len(tracks), 4)
+        self.assertIs(self.skill._cached_search('artist', "artist 1"), tracks)
+        self.skill.update_library()
+        self.assertIsNot(self.skill._cached_search('artist', "artist 1"),
+                         tracks)
+        tracks = self.skill._cached_search('artist', "artist 1")
+        # Results cached before a library change are not reused
+        self.skill.music_library.generation += 1
+        self.assertIsNot(self.skill._cached_search('artist', "artist 1"),
+                         tracks)
+
     def test_parse_track_from_file_path(self):
         method = self.skill.music_library._parse_track_from_file
 
@@ -86,6 +111,19 @@ class TestSkillMethods(SkillTestCase):
         self.assertEqual(test_untagged.album, "Album 1")
         self.assertEqual(test_untagged.artist, "Artist 1")
 
+        from skill_local_music.util import MusicLibrary
+        untitled = MusicLibrary.song_from_file_path(
+            join("/library", "Artist 2", "Album 3", "Song Title.wav"))
+        self.assertEqual(untitled.title, "Song Title")
+        self.assertEqual(untitled.track, 0)
+        self.assertEqual(untitled.album, "Album 3")
+        self.assertEqual(untitled.artist, "Artist 2")
+        unsorted = MusicLibrary.song_from_file_path(
+            join("/library", "Music", "01 Song.wav"))
+        self.assertEqual(unsorted.track, 1)
+        self.assertIsNone(unsorted.album)
+        self.assertIsNone(unsorted.artist)
+
         mp3_file = join(dirname(__file__), 'test_music', "Test_Track.mp3")
         test_tagged = method(mp3_file, None)
         self.assertEqual(test_tagged.path, mp3_file)
@@ -94,6 +132,87 @@ class TestSkillMethods(SkillTestCase):
                          "Theodore: An Alternative Music Sampler")
         self.assertEqual(test_tagged.artist, "3rd Bass")
         self.assertEqual(test_tagged.genre, "Alternative")
+        self.assertTrue(isfile(test_tagged.artwork))
+
+        # Tracks are still parsed if their art can't be written
+        from skill_local_music.util import _parse_track_from_file
+        no_art = _parse_track_from_file(mp3_file, "/nonexistent")
+        self.assertEqual(no_art.title, test_tagged.title)
+        self.assertIsNone(no_art.artwork)
+
+        # Directory art is used instead of embedded art
+        folder_art = join(dirname(mp3_file), "Folder.jpg")
+        self.assertEqual(method(mp3_file, folder_art).artwork, folder_art)
+
+    def test_parse_track_number(self):
+        from skill_local_music.util import _parse_track_number
+        for value, track in ((3, 3), ("3", 3), ("03/12", 3), (" 7", 7),
+                             ("A1", 0), ("", 0), (None, 0)):
+            self.assertEqual(_parse_track_number(value), track, value)
+
+    def test_album_art_filename(self):
+        from hashlib import md5
+        from skill_local_music.util import _album_art_filename, \
+            _AlbumArtCache
+        image = b"test image" * 100
+        art_cache = _AlbumArtCache()
+        filename = _album_art_filename(image, "/music/Artist/Album", art_cache)
+        self.assertEqual(filename, md5(image).hexdigest())
+        with patch("skill_local_music.util.hashlib.md5") as hash_fn:
+            self.assertEqual(_album_art_filename(image, "/music/Artist/Album",
+                                                 art_cache), filename)
+            hash_fn.assert_not_called()
+            _album_art_filename(image, "/music/Artist/Other Album", art_cache)
+            hash_fn.assert_called_once_with(image)
+            # Digests aren't shared between scans
+            _album_art_filename(image, "/music/Artist/Album",
+                                _AlbumArtCache())
+            self.assertEqual(hash_fn.call_count, 2)
+
+    def test_debug_enabled(self):
+        from ovos_utils.log import LOG
+        from skill_local_music.util import debug_enabled
+        for level, enabled in (("DEBUG", True), ("debug", True),
+                               ("INFO", False), (10, True), (30, False)):
+            with patch.object(LOG, "level", level):
+                self.assertEqual(debug_enabled(), enabled, level)
+
+    def test_write_album_art(self):
+        from tempfile import TemporaryDirectory
+        from skill_local_music.util import _write_album_art, _AlbumArtCache
+        image = b"test image" * 100
+        with TemporaryDirectory() as cache_path:
+            art_cache = _AlbumArtCache()
+            art = _write_album_art(image, "test", cache_path, art_cache)
+            self.assertEqual(art, join(cache_path, "test.jpg"))
+            with open(art, 'rb') as f:
+                self.assertEqual(f.read(), image)
+            self.assertEqual(listdir(cache_path), ["test.jpg"])
+            # Known art files are reused without checking the filesystem
+            with patch("skill_local_music.util.isfile") as isfile_fn:
+                self.assertEqual(_write_album_art(image, "test", cache_path,
+                                                  art_cache), art)
+                isfile_fn.assert_not_called()
+
+        # Failed writes don't leave temporary files behind
+        with TemporaryDirectory() as cache_path:
+            with patch("skill_local_music.util.replace",
+                       side_effect=OSError("No space left on device")):
+                with self.assertRaises(OSError):
+                    _write_album_art(image, "failed", cache_path,
+                                     _AlbumArtCache())
+            self.assertEqual(listdir(cache_path), [])
+
+        # Threads writing the same new cover don't collide
+        from concurrent.futures import ThreadPoolExecutor
+        with TemporaryDirectory() as cache_path:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                arts = list(executor.map(
+                    lambda _: _write_album_art(image, "shared", cache_path,
+                                               _AlbumArtCache()),
+                    range(8)))
+            self.assertEqual(set(arts), {join(cache_path, "shared.jpg")})
+            self.assertEqual(listdir(cache_path), ["shared.jpg"])
 
     def test_download_demo_tracks(self):
         test_dir = join(dirname(__file__), "demo_test")
@@ -103,64 +222,288 @@ class TestSkillMethods(SkillTestCase):
         self.skill._download_demo_tracks()
         self.assertTrue(isdir(test_dir))
 
+    def test_is_local_phrase(self):
+        for phrase in ("play local music", "music on usb", "local",
+                       "something locally", "play my music", "localhost",
+                       ""):
+            self.assertEqual(self.skill._is_local_phrase(phrase),
+                             self.skill.voc_match(phrase, 'local.voc'),
+                             phrase)
+
+    def test_parse_tracks(self):
+        lib = self.skill.music_library
+        test_dir = join(dirname(__file__), "demo_test", "Jazz")
+        files = [join(test_dir, file) for file in sorted(listdir(test_dir))]
+        with patch.object(lib, "_min_parallel_files", len(files) + 1), \
+                patch("skill_local_music.util.ProcessPoolExecutor") as pool:
+            serial = lib._parse_tracks(files, [None] * len(files))
+            pool.assert_not_called()
+        lib._min_parallel_files = 0
+        try:
+            with patch("skill_local_music.util.cpu_count", return_value=2):
+                parallel = lib._parse_tracks(files, [None] * len(files))
+            with patch("skill_local_music.util.cpu_count", return_value=1):
+                threaded = lib._parse_tracks(files, [None] * len(files))
+            # Workers are limited by the batch size and an upper bound
+            from concurrent.futures import ProcessPoolExecutor
+            with patch("skill_local_music.util.cpu_count", return_value=64), \
+                    patch("skill_local_music.util.ProcessPoolExecutor",
+                          wraps=ProcessPoolExecutor) as pool:
+                lib._parse_tracks(files[:3], [None] * 3)
+            self.assertEqual(pool.call_args.kwargs["max_workers"], 3)
+            # Files are parsed serially if the worker pool fails
+            from concurrent.futures.process import BrokenProcessPool
+            with patch("skill_local_music.util.cpu_count", return_value=2), \
+                    patch("skill_local_music.util.ProcessPoolExecutor",
+                          side_effect=BrokenProcessPool("worker died")):
+                fallback = lib._parse_tracks(files, [None] * len(files))
+        finally:
+            del lib._min_parallel_files
+        self.assertEqual(len(serial), len(files))
+        self.assertEqual(serial, parallel)
+        self.assertEqual(serial, threaded)
+        self.assertEqual(serial, fallback)
+
+    def test_search_music(self):
+        from ovos_plugin_common_play import MediaType
+        self.assertTrue(self.skill.library_update_event.wait())
+        results = self.skill.search_music("play artist 1", MediaType.MUSIC)
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertEqual(result['artist'], "Artist 1")
+            self.assertEqual(result['match_confidence'], 85)
+        self.assertEqual(self.skill.search_music("nothing here"), [])
+        self.assertEqual(self.skill.search_music(" a "), [])
+
+        # Tracks matching multiple categories are returned once
+        results = self.skill.search_music("artist 1 album 1", MediaType.MUSIC)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len({r['uri'] for r in results}), 4)
+        self.assertEqual([r['match_confidence'] for r in results],
+                         [90, 90, 85, 85])
+
+    def test_update_library_in_progress(self):
+        self.assertTrue(self.skill.library_update_event.wait())
+        self.skill._updating = True
+        try:
+            with patch.object(self.skill, "_update_library") as update:
+                self.skill.update_library()
+                update.assert_not_called()
+            self.assertTrue(self.skill._update_pending)
+        finally:
+            self.skill._updating = False
+            self.skill._update_pending = False
+        self.assertTrue(self.skill.library_update_event.is_set())
+
     def test_update_library(self):
-        real_songs = self.skill.music_library._songs
-        mock_songs = dict()
-        self.skill.music_library._songs = mock_songs
+        from tempfile import TemporaryDirectory
+        from skill_local_music.util import MusicLibrary
         test_dir = join(dirname(__file__), "test_music")
-        self.skill.music_library.update_library(test_dir)
-        self.assertGreaterEqual(len(mock_songs.keys()), 1)
-        self.assertIsNone(mock_songs.get(join(test_dir, ".ds_store")))
-        self.assertIsNone(mock_songs.get(join(test_dir, "desktop")))
-        id3_tested = False
-        for file in mock_songs.keys():
-            track = self.skill.music_library._parse_track_from_file(file)
-            # self.assertIsInstance(track, Track)
-            self.assertIsInstance(track.path, str)
-            self.assertIsInstance(track.title, str)
-            self.assertIsInstance(track.album, str)
-            self.assertIsInstance(track.artist, str)
-            if track.genre:
-                self.assertIsInstance(track.genre, str)
-            self.assertIsInstance(track.duration_ms, int)
-
-            track_2 = self.skill.music_library._parse_id3_tags(file)
-            if track_2:
-                id3_tested = True
-                self.assertEqual(track_2.path, track.path)
-                self.assertEqual(track_2.title, track.title)
-                self.assertEqual(track_2.album, track.album)
-                self.assertEqual(track_2.artist, track.artist)
-                self.assertEqual(track_2.genre, track.genre)
-                # self.assertEqual(track_2.duration_ms, track.duration_ms)
-        self.assertTrue(id3_tested)
-        self.skill.music_library._songs = real_songs
+        with TemporaryDirectory() as tmp:
+            lib = MusicLibrary(test_dir, tmp)
+            mock_songs = lib._songs
+            lib.update_library(test_dir)
+            self.assertGreaterEqual(len(mock_songs.keys()), 1)
+            self.assertIsNone(mock_songs.get(join(test_dir, ".ds_store")))
+            self.assertIsNone(mock_songs.get(join(test_dir, "desktop")))
+            id3_tested = False
+            for file in mock_songs.keys():
+                track = lib._parse_track_from_file(file)
+                # self.assertIsInstance(track, Track)
+                self.assertIsInstance(track.path, str)
+                self.assertIsInstance(track.title, str)
+                self.assertIsInstance(track.album, str)
+                self.assertIsInstance(track.artist, str)
+                if track.genre:
+                    self.assertIsInstance(track.genre, str)
+                self.assertIsInstance(track.duration_ms, int)
+
+                track_2 = lib._parse_id3_tags(file)
+                if track_2:
+                    id3_tested = True
+                    self.assertEqual(track_2.path, track.path)
+                    self.assertEqual(track_2.title, track.title)
+                    self.assertEqual(track_2.album, track.album)
+                    self.assertEqual(track_2.artist, track.artist)
+                    self.assertEqual(track_2.genre, track.genre)
+                    # self.assertEqual(track_2.duration_ms, track.duration_ms)
+            self.assertTrue(id3_tested)
+
+            # Unchanged files are not parsed again; modified files are
+            mp3_file = join(test_dir, "Test_Track.mp3")
+            track = mock_songs[mp3_file]
+            with patch.object(lib, "_write_db") as write:
+                lib.update_library(test_dir)
+                write.assert_not_called()
+            self.assertIs(mock_songs[mp3_file], track)
+            track.mtime = 0
+            lib.update_library(test_dir)
+            self.assertIsNot(mock_songs[mp3_file], track)
+            self.assertEqual(mock_songs[mp3_file].title, track.title)
+            # Search index is updated with the re-parsed track
+            results = lib.search_songs_for_artist("3rd bass")
+            self.assertTrue(any(t is mock_songs[mp3_file] for t in results))
+            self.assertFalse(any(t is track for t in results))
+
+    def test_parse_tracks_bad_file(self):
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as tmp:
+            bad_file = join(tmp, "01 Bad.mp3")
+            with open(bad_file, 'wb') as f:
+                # Truncated ID3 header
+                f.write(b'ID3\x03\x00\x00\x00\x00\x00\x0aTIT2\x00\x00'
+                        b'\x00\x02\x00\x00')
+            good_file = join(dirname(__file__), "test_music", "Test_Track.mp3")
+            lib = self.skill.music_library
+            for cpus in (1, 2):
+                with patch("skill_local_music.util.cpu_count",
+                           return_value=cpus), \
+                        patch.object(lib, "_min_parallel_files", 1):
+                    tracks = lib._parse_tracks([bad_file, good_file],
+                                               [None, None])
+                self.assertEqual([t.path for t in tracks],
+                                 [bad_file, good_file])
+                self.assertEqual(tracks[0].title, "Bad")
+                self.assertEqual(tracks[1].title, "Triple Stage Darkness")
+
+    def test_update_library_folder_art(self):
+        from tempfile import TemporaryDirectory
+        from skill_local_music.util import MusicLibrary
+        with TemporaryDirectory() as tmp:
+            album_dir = join(tmp, "music", "Artist", "Album")
+            makedirs(album_dir)
+            for file in ("Folder.jpg", "01 Song.mp3"):
+                with open(join(album_dir, file), 'w'):
+                    pass
+            lib = MusicLibrary(join(tmp, "music"), join(tmp, "cache"))
+            lib.update_library()
+            self.assertEqual(len(lib.all_songs), 1)
+            self.assertEqual(lib.all_songs[0].artwork,
+                             join(album_dir, "Folder.jpg"))
+
+    def test_update_library_audio_formats(self):
+        from tempfile import TemporaryDirectory
+        from skill_local_music.util import MusicLibrary
+        with TemporaryDirectory() as tmp:
+            album_dir = join(tmp, "music", "Artist", "Album")
+            makedirs(album_dir)
+            for file in ("01 A.aiff", "02 B.m4b", "03 C.oga", "04 D.mp3",
+                         "06 F.mp4", "cover.png", "Clip.m4v", "Clip.ogv",
+                         "Clip.wmv", "Clip.asf"):
+                with open(join(album_dir, file), 'w'):
+                    pass
+            # Files that can't be read are skipped
+            symlink(join(tmp, "missing.mp3"), join(album_dir, "05 E.mp3"))
+            lib = MusicLibrary(join(tmp, "music"), join(tmp, "cache"))
+            lib.update_library()
+            self.assertEqual(sorted(t.title for t in lib.all_songs),
+                             ["A", "B", "C", "D", "F"])
+
+    def test_update_library_rewrites_art(self):
+        from shutil import copy
+        from tempfile import TemporaryDirectory
+        from skill_local_music.util import MusicLibrary
+        with TemporaryDirectory() as tmp:
+            album_dir = join(tmp, "music", "Artist", "Album")
+            makedirs(album_dir)
+            mp3_file = copy(join(dirname(__file__), "test_music",
+                                 "Test_Track.mp3"), album_dir)
+            lib = MusicLibrary(join(tmp, "music"), join(tmp, "cache"))
+            lib.update_library()
+            artwork = lib._songs[mp3_file].artwork
+            self.assertTrue(isfile(artwork))
+
+            # A cover removed from the cache is written again on rescan
+            remove(artwork)
+            lib._songs[mp3_file].mtime = 0
+            lib.update_library()
+            self.assertEqual(lib._songs[mp3_file].artwork, artwork)
+            self.assertTrue(isfile(artwork))
+
+            # Each scan remembers album art separately
+            with patch.object(lib, "_parse_tracks",
+                              wraps=lib._parse_tracks) as parse:
+                for _ in range(2):
+                    lib._songs[mp3_file].mtime = 0
+                    lib.update_library()
+            first, second = (call.args[2] for call in parse.call_args_list)
+            self.assertIsNot(first, second)
+
+    def test_library_cache(self):
+        from tempfile import TemporaryDirectory
+        from skill_local_music.util import MusicLibrary
+        with TemporaryDirectory() as tmp:
+            lib = MusicLibrary(join(dirname(__file__), "test_music"), tmp)
+            lib.update_library()
+            expected = [t.path for t in
+                        lib.search_songs_for_artist("artist 1")]
+            self.assertEqual(len(expected), 4)
+
+            # The search index is loaded with the songs, not rebuilt
+            with patch.object(MusicLibrary, "_index_song") as index:
+                cached = MusicLibrary(lib.library_paths[0], tmp)
+                index.assert_not_called()
+            self.assertEqual(len(cached.all_songs), len(lib.all_songs))
+            self.assertEqual([t.path for t in
+                              cached.search_songs_for_artist("artist 1")],
+                             expected)
+            self.assertTrue(all(t is cached._songs[t.path] for t in
+                                cached.search_songs_for_artist("artist 1")))
+            for track in cached.all_songs:
+                self.assertEqual(track, lib._songs[track.path])
+                # Loaded values are shared with tracks parsed later
+                if track.artist:
+                    self.assertIs(cached._strings[track.artist],
+                                  track.artist)
+
+            # A failed write keeps the old cache and removes the temp file
+            with patch("skill_local_music.util.pickle.dump",
+                       side_effect=OSError("No space left on device")):
+                lib._write_db()
+            self.assertFalse(isfile(f"{lib._db_file}.tmp"))
+            self.assertEqual(len(MusicLibrary(lib.library_paths[0],
+                                              tmp).all_songs),
+                             len(lib.all_songs))
+
+            # Caches written by another version are ignored
+            with open(lib._db_file, 'rb') as f:
+                cache = f.read()
+            with open(lib._db_file, 'wb') as f:
+                f.write(b'NMUS' + struct.pack('<I', 0) + cache[8:])
+            self.assertEqual(MusicLibrary(lib.library_paths[0], tmp).all_songs,
+                             [])
 
     def test_demo_music(self):
-        real_songs = self.skill.music_library._songs
-        real_paths = self.skill.music_library.library_paths
-        self.skill.music_library.library_paths = []
-        self.skill.music_library._songs = dict()
-        self.assertEqual(self.skill.music_library._songs, dict())
-        self.assertEqual(self.skill.music_library.all_songs, [])
+        from tempfile import TemporaryDirectory
+        from skill_local_music.util import MusicLibrary
         test_dir = join(dirname(__file__), "demo_test")
-        self.skill.music_library.update_library(test_dir)
-
-        self.assertEqual(len(self.skill.music_library._songs), 30)
-        for track in self.skill.music_library.all_songs:
-            # self.assertIsInstance(track.album, str, track.path)
-            self.assertIsInstance(track.artist, str, track.path)
-            # self.assertIsInstance(track.artwork, str, track.path)
-            self.assertIsInstance(track.duration_ms, int, track.path)
-            self.assertIsInstance(track.genre, str, track.path)
-            self.assertIsInstance(track.title, str, track.path)
-            self.assertIsNotNone(track.title, track.path)
-            # self.assertIsInstance(track.track, int, track.path)
-            # self.assertTrue(isfile(track.artwork), track.path)
-            self.assertTrue(isfile(track.path), track.path)
-
-        self.skill.music_library.library_paths = real_paths
-        self.skill.music_library._songs = real_songs
+        with TemporaryDirectory() as tmp:
+            lib = MusicLibrary(test_dir, tmp)
+            self.assertEqual(lib._songs, dict())
+            self.assertEqual(lib.all_songs, [])
+            lib.update_library(test_dir, is_demo=True)
+
+            self.assertEqual(len(lib._songs), 30)
+            for track in lib.all_songs:
+                self.assertTrue(track.is_demo, track.path)
+                # self.assertIsInstance(track.album, str, track.path)
+                self.assertIsInstance(track.artist, str, track.path)
+                # self.assertIsInstance(track.artwork, str, track.path)
+                self.assertIsInstance(track.duration_ms, int, track.path)
+                self.assertIsInstance(track.genre, str, track.path)
+                self.assertIsInstance(track.title, str, track.path)
+                self.assertIsNotNone(track.title, track.path)
+                # self.assertIsInstance(track.track, int, track.path)
+                # self.assertTrue(isfile(track.artwork), track.path)
+                self.assertTrue(isfile(track.path), track.path)
+
+            # Tracks with the same tag values share string objects
+            albums = dict()
+            for track in lib.all_songs:
+                if track.album:
+                    self.assertIs(albums.setdefault(track.album, track.album),
+                                  track.album)
+            self.assertLess(len(albums), 30)
     # TODO: OCP Search method tests
 
 
@@ -27,18 +27,46 @@
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import hashlib
+import logging
 import pickle
-from threading import RLock
-from typing import List, Optional
+import re
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import repeat
+from multiprocessing import get_context
+from operator import attrgetter
+from threading import RLock, get_ident
+from typing import Iterator, List, Optional, Tuple
 import ovos_ocp_files_plugin
 
-from dataclasses import dataclass
-from os import walk, makedirs, remove
-from os.path import join, expanduser, isfile, dirname, basename, splitext, isdir
+from dataclasses import dataclass, field, fields
+from os import DirEntry, getpid, makedirs, remove, replace, scandir, \
+    cpu_count
+from os.path import join, expanduser, isfile, dirname, basename, splitext
 from ovos_utils.log import LOG
+from tinytag import TinyTag
 
+try:
+    from id3parse import ID3
+except ImportError:
+    ID3 = None
 
-@dataclass
+# Bump when Track fields or the cached (songs, index) layout change
+_CACHE_VERSION = 1
+_CACHE_HEADER = b'NMUS' + struct.pack('<I', _CACHE_VERSION)
+# Extensions indexed by `update_library`. `.mp4` is kept since it is often
+# used for audio-only files; video-only containers are excluded.
+_AUDIO_EXTS = frozenset(TinyTag.SUPPORTED_FILE_EXTENSIONS).union(
+    {'.aac'}).difference({'.m4v', '.ogv', '.wmv', '.asf'})
+# Leading digits of a track number tag, e.g. "3" or "3/12"
+_TRACK_RE = re.compile(r'^\s*(\d+)')
+
+
+# Slots avoid a per-instance `__dict__`; only supported on Python 3.10+
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
 class Track:
     path: str
     title: str
@@ -48,11 +76,324 @@ class Track:
     artwork: str = None
     duration_ms: float = 0
     track: int = 0
+    mtime: float = 0
+    size: int = 0
+    is_demo: bool = False
+
+    def __reduce__(self):
+        # Pickle as constructor arguments, which load much faster than
+        # restoring each field from a state dict
+        return Track, _track_values(self)
+
+
+_track_values = attrgetter(*(field.name for field in fields(Track)))
+
+
+@dataclass
+class _AlbumArtCache:
+    """
+    Album art seen during one library scan. Each scan and each parse worker
+    process has its own, so covers removed or re-tagged since the last scan
+    are found again.
+    """
+    # Album art filenames by (directory, image size, trailing bytes)
+    filenames: dict = field(default_factory=dict)
+    # Album art files written to (or found in) the cache
+    files: set = field(default_factory=set)
+
+
+# Album art cache of a parse worker process, set by `_init_parse_worker`
+_worker_art_cache = None
+
+
+def debug_enabled() -> bool:
+    """
+    Check if debug logs will be emitted. `LOG.debug` inspects the call stack
+    before the log level is checked, so calls made per file are guarded.
+    """
+    level = LOG.level
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    return isinstance(level, int) and level <= logging.DEBUG
+
+
+def _parse_track_from_file(file_path: str, cache_path: str,
+                           album_art: Optional[str] = None,
+                           art_cache: Optional[_AlbumArtCache] = None) -> \
+        Track:
+    """
+    Parse a Track from the tags of an audio file. Files that can't be
+    parsed are added from their path so one bad file can't fail a batch.
+    :param file_path: path to the audio file to parse
+    :param cache_path: directory to write extracted album art to
+    :param album_art: path to the directory's album art; embedded art is
+        only read if this is None
+    :param art_cache: album art seen so far in this scan
+    :returns: parsed Track
+    """
+    if art_cache is None:
+        art_cache = _AlbumArtCache()
+    try:
+        return _parse_tags(file_path, cache_path, album_art, art_cache)
+    except Exception as e:
+        LOG.exception(f"{file_path} encountered error: {e}")
+        return MusicLibrary.song_from_file_path(file_path, album_art)
+
+
+def _init_parse_worker():
+    """
+    Give a new parse worker process its own album art cache.
+    """
+    global _worker_art_cache
+    _worker_art_cache = _AlbumArtCache()
+
+
+def _parse_track_in_worker(file_path: str, cache_path: str,
+                           album_art: Optional[str] = None) -> Track:
+    """
+    Parse a Track in a worker process started with `_init_parse_worker`.
+    This is a module-level function so it may be pickled for the pool.
+    """
+    return _parse_track_from_file(file_path, cache_path, album_art,
+                                  _worker_art_cache)
+
+
+def _parse_tags(file_path: str, cache_path: str, album_art: Optional[str],
+                art_cache: _AlbumArtCache) -> Track:
+    """
+    Parse a Track with tinytag, falling back to the OCP files plugin.
+    """
+    try:
+        tag = TinyTag.get(file_path, image=album_art is None)
+    except Exception as e:
+        if debug_enabled():
+            LOG.debug(f"{file_path} unsupported by tinytag: {e}")
+        tag = None
+    if not tag or not tag.title:
+        return _parse_audio_metadata(file_path, cache_path, album_art,
+                                     art_cache)
+
+    image = tag.images.any if album_art is None else None
+    if image and image.data:
+        album_art = _cache_album_art(image.data, file_path, cache_path,
+                                     art_cache)
+    song = Track(file_path, tag.title, tag.album, tag.artist, tag.genre,
+                 album_art, round(tag.duration or 0) * 1000, tag.track or 0)
+    if debug_enabled():
+        LOG.debug(song)
+    return song
+
+
+def _parse_audio_metadata(file_path: str, cache_path: str,
+                          album_art: Optional[str],
+                          art_cache: _AlbumArtCache) -> Track:
+    """
+    Parse a Track with the OCP files plugin, falling back to ID3 tags and
+    then the file path.
+    """
+    try:
+        meta = ovos_ocp_files_plugin.load(file_path)
+        image_bytes = meta.pictures[0].data \
+            if meta.pictures and album_art is None else None
+        album = meta.tags['album'][0]
+        artist = meta.tags['artist'][0]
+        genre = meta.tags['genre'][0] if 'genre' in meta.tags \
+            else None  # Handle missing genre tag
+        title = meta.tags['title'][0]
+        track_no = meta.tags['tracknumber'][0]
+        duration_seconds = round(meta.streaminfo['duration'])
+
+        if image_bytes:
+            album_art = _cache_album_art(image_bytes, file_path, cache_path,
+                                         art_cache)
+
+        song = Track(file_path, title, album, artist, genre, album_art,
+                     duration_seconds * 1000, _parse_track_number(track_no))
+        if debug_enabled():
+            LOG.debug(song)
+        return song
+    except ovos_ocp_files_plugin.UnsupportedFormat as e:
+        LOG.warning(f"{file_path} unsupported by files plugin: {e}")
+        track = _parse_id3_tags(file_path)
+    except KeyError as e:
+        LOG.error(e)
+        track = _parse_id3_tags(file_path)
+
+    except Exception as e:
+        LOG.exception(f"{file_path} encountered error: {e}")
+        track = _parse_id3_tags(file_path)
+
+    return track or MusicLibrary.song_from_file_path(file_path, album_art)
+
+
+def _parse_id3_tags(file_path: str) -> Optional[Track]:
+    if ID3 is None:
+        return None
+    tag = ID3.from_file(file_path)
+    if tag:
+        data = dict()
+        debug = debug_enabled()
+        for t in ('TPE1', 'TALB', 'TIT2', 'TRCK', 'TCON', 'TLEN'):
+            try:
+                data[t] = tag.find_frame_by_name(t).text
+            except ValueError:
+                if debug:
+                    LOG.debug(f"No tag: {t} for file: "
+                              f"{basename(file_path)}")
+                data[t] = None
+        if not data.get('TIT2'):
+            return None
+        # TLEN is unreliable for track length, so let the player decide len
+        return Track(file_path, data.get('TIT2'), data.get('TALB'),
+                     data.get('TPE1'), data.get('TCON'),
+                     # duration_ms=round(float(data.get('TLEN') or 0)),
+                     track=_parse_track_number(data.get('TRCK')))
+
+
+def _parse_track_number(track_no) -> int:
+    """
+    Get a track number from a tag value, e.g. 3 for "3" or "3/12".
+    :param track_no: track number tag value
+    :returns: parsed track number, or 0 if not numeric
+    """
+    if isinstance(track_no, int):
+        return track_no
+    match = _TRACK_RE.match(str(track_no or ""))
+    if not match:
+        if track_no:
+            LOG.warning(f"Non-numeric track number: {track_no}")
+        return 0
+    return int(match.group(1))
+
+
+@lru_cache(maxsize=1024)
+def _album_and_artist(directory: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Get album and artist names from a track's directory, expecting
+    <Artist>/<Album>/. Results are cached since every untagged track in an
+    album shares its directory.
+    :param directory: directory containing the track
+    :returns: (album, artist), or (None, None) if the directory isn't in an
+        <Artist>/<Album> structure
+    """
+    album = basename(directory)
+    artist = basename(dirname(directory))
+    if 'music' in {album.lower(), artist.lower()}:
+        LOG.warning(f"{directory} not in an expected directory structure")
+        return None, None
+    return album, artist
+
+
+def _album_art_filename(image_bytes: bytes, directory: str,
+                        art_cache: _AlbumArtCache) -> str:
+    """
+    Get the cache filename (MD5 hex digest) for embedded album art. Tracks of
+    an album usually embed the same cover, so digests are remembered by
+    directory, image size and trailing bytes to hash each cover only once.
+    :param image_bytes: embedded image data
+    :param directory: directory containing the track the image came from
+    :param art_cache: album art seen so far in this scan
+    :returns: hex digest to use as the album art filename
+    """
+    key = (directory, len(image_bytes), image_bytes[-64:])
+    if key not in art_cache.filenames:
+        art_cache.filenames[key] = hashlib.md5(image_bytes).hexdigest()
+    return art_cache.filenames[key]
+
+
+def _cache_album_art(image_bytes: bytes, file_path: str, cache_path: str,
+                     art_cache: _AlbumArtCache) -> Optional[str]:
+    """
+    Write a track's embedded album art to the cache.
+    :param image_bytes: embedded image data
+    :param file_path: path to the track the image came from
+    :param cache_path: directory to write the image to
+    :param art_cache: album art seen so far in this scan
+    :returns: path to the cached image, or None if it couldn't be written
+    """
+    filename = _album_art_filename(image_bytes, dirname(file_path),
+                                   art_cache)
+    try:
+        return _write_album_art(image_bytes, filename, cache_path, art_cache)
+    except OSError as e:
+        LOG.error(f"Failed to write album art for {file_path}: {e}")
+        return None
+
+
+def _write_album_art(image_bytes: bytes, filename: str, cache_path: str,
+                     art_cache: _AlbumArtCache) -> str:
+    """
+    Write album art to the cache if it isn't there already. Parse workers
+    may write the same cover at once, so each thread writes its own temporary
+    file and moves it into place.
+    :param image_bytes: image data to write
+    :param filename: cache filename (without extension) for the image
+    :param cache_path: directory to write the image to
+    :param art_cache: album art seen so far in this scan
+    :returns: path to the cached image
+    """
+    output_file = join(cache_path, f'{filename}.jpg')
+    if output_file in art_cache.files:
+        return output_file
+    if not isfile(output_file):
+        tmp_file = f"{output_file}.{getpid()}.{get_ident()}.tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(image_bytes)
+            replace(tmp_file, output_file)
+            LOG.info(f"Wrote album art to: {output_file}")
+        except OSError:
+            try:
+                remove(tmp_file)
+            except FileNotFoundError:
+                pass
+            # Another worker may have written this cover first
+            if not isfile(output_file):
+                raise
+    art_cache.files.add(output_file)
+    return output_file
+
+
+def _scan_dir(root: str) -> Iterator[Tuple[str, List[DirEntry]]]:
+    """
+    Walk a directory tree with `os.scandir`, yielding each directory path with
+    the file entries it contains. Hidden files and directories are skipped by
+    name and, as with `os.walk`, symlinked directories are not followed.
+    :param root: directory to walk
+    :returns: iterator of (directory path, list of file DirEntry objects)
+    """
+    dirs = [root]
+    while dirs:
+        path = dirs.pop()
+        files = list()
+        try:
+            with scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if not entry.is_dir():
+                        files.append(entry)
+                    elif not entry.is_symlink():
+                        dirs.append(entry.path)
+        except OSError as e:
+            LOG.warning(f"Unable to scan {path}: {e}")
+            continue
+        yield path, files
+
 
 # TODO: Replace w/ https://github.com/OpenVoiceOS/ovos-ocp-audio-plugin/pull/30
 
 
 class MusicLibrary:
+    _index_fields = ("artist", "album", "genre", "title")
+    # Smaller batches are parsed in this process. Each spawned worker takes
+    # ~0.6s to import the skill's dependencies, and serial parsing runs at
+    # ~0.7ms per file, so a pool only pays off for cold scans of thousands
+    # of files.
+    _min_parallel_files = 5000
+    # Each worker process imports the tag parsers, so limit how many start
+    _max_parse_workers = 8
+
     def __init__(self, library_path: str, cache_path: str):
         """
         Initialize a Library object for the specified path, optionally loading
@@ -60,24 +401,38 @@ class MusicLibrary:
         :param library_path: path to scan for music files
         :param cache_path: path to cache directory for library and temp files
         """
-        # Hidden files (starting with `.`) are always ignored
-        self._ignored_files = ("desktop.ini", "desktop", "Attribution.pdf")
+        # Hidden files and directories (starting with `.`) are always ignored
+        self._ignored_files = frozenset({"desktop.ini", "desktop",
+                                         "Attribution.pdf"})
         self._update_lock = RLock()
         library_path = expanduser(library_path)
         assert library_path is not None
         self.library_paths = [library_path]
         self.cache_path = expanduser(cache_path)
-        if not isdir(self.cache_path):
-            makedirs(self.cache_path)
+        makedirs(self.cache_path, exist_ok=True)
         self._songs = dict()
+        self._index = {field: dict() for field in self._index_fields}
+        # Incremented each time an update changes the library
+        self.generation = 0
+        # Shared string objects for repeated album, artist and genre values
+        self._strings = dict()
         self._db_file = join(self.cache_path, "library.pickle")
         with self._update_lock:
             try:
-                if isfile(self._db_file):
-                    with open(self._db_file, 'rb') as f:
-                        self._songs = pickle.load(f)
+                with open(self._db_file, 'rb') as f:
+                    if f.read(len(_CACHE_HEADER)) == _CACHE_HEADER:
+                        self._songs, self._index = pickle.load(f)
+                        # Share loaded values with newly parsed tracks
+                        for song in self._songs.values():
+                            self._intern_fields(song)
+                    else:
+                        LOG.info("Ignoring library cache from another "
+                                 "version")
+            except FileNotFoundError:
+                pass
             except Exception as e:
                 LOG.exception(e)
+                self._songs = dict()
                 remove(self._db_file)
 
     @property
@@ -87,143 +442,237 @@ class MusicLibrary:
     def search_songs_for_artist(self, artist: str) -> List[Track]:
         """
         Get all songs by a particular artist
+        :param artist: search phrase; songs match if their artist appears in
+            the phrase as whole words, e.g. "play artist 1" finds "Artist 1"
         """
-        return [song for song in self._songs.values() if song.artist and
-                f" {song.artist.lower()} " in f" {artist.lower()} "]
+        return self._search_index("artist", artist)
 
     def search_songs_for_album(self, album: str) -> List[Track]:
         """
-        Get all songs from a particular album
+        Get all songs from a particular album, sorted by track number
+        :param album: search phrase that may contain an album name
         """
-        tracks = [song for song in self._songs.values() if song.album and
-                  f" {song.album.lower()} " in f" {album.lower()} "]
+        tracks = self._search_index("album", album)
         tracks.sort(key=lambda i: i.track)
         return tracks
 
     def search_songs_for_genre(self, genre: str) -> List[Track]:
         """
-        Get all songs or a particular genre
+        Get all songs of a particular genre
+        :param genre: search phrase that may contain a genre
         """
-        return [song for song in self._songs.values() if song.genre and
-                f" {song.genre.lower()} " in f" {genre.lower()} "]
+        return self._search_index("genre", genre)
 
     def search_songs_for_track(self, track: str) -> List[Track]:
         """
         Search songs for a specific track
+        :param track: search phrase that may contain a track title
+        """
+        return self._search_index("title", track)
+
+    def _search_index(self, field: str, phrase: str) -> List[Track]:
+        """
+        Get all songs where the value of `field` appears as whole words in
+        `phrase`. The index for each field is a trie of words, so each word
+        in the phrase is only visited while it continues a known value.
         """
-        return [song for song in self._songs.values() if song.title and
-                f" {song.title.lower()} " in f" {track.lower()} "]
+        root = self._index[field]
+        words = phrase.casefold().split()
+        tracks = list()
+        # A value may appear more than once in the phrase
+        seen = set()
+        for start in range(len(words)):
+            node = root
+            for idx in range(start, len(words)):
+                node = node.get(words[idx])
+                if node is None:
+                    break
+                for track in node.get(None, []):
+                    if id(track) not in seen:
+                        seen.add(id(track))
+                        tracks.append(track)
+        return tracks
 
-    def update_library(self, lib_path: str = None):
+    def _index_song(self, song: Track):
+        """
+        Add a song to the search index. Each field maps to a trie of
+        casefolded words, where the `None` key of a node holds the songs
+        whose value ends at that node.
+        """
+        for field, root in self._index.items():
+            words = (getattr(song, field) or "").casefold().split()
+            if not words:
+                continue
+            node = root
+            for word in words:
+                node = node.setdefault(word, dict())
+            node.setdefault(None, []).append(song)
+
+    def _intern_fields(self, song: Track):
+        """
+        Replace a song's album, artist and genre with string objects shared
+        by all songs with the same value, so each repeated value is stored
+        once in memory and in the cache.
+        """
+        for field in ("album", "artist", "genre"):
+            value = getattr(song, field)
+            if value:
+                setattr(song, field, self._strings.setdefault(value, value))
+
+    def _unindex_song(self, song: Track):
+        """
+        Remove a song from the search index.
+        """
+        for field, root in self._index.items():
+            node = root
+            for word in (getattr(song, field) or "").casefold().split():
+                node = node.get(word)
+                if node is None:
+                    break
+            if node and None in node:
+                node[None] = [s for s in node[None] if s is not song]
+
+    def update_library(self, lib_path: str = None, is_demo: bool = False):
+        """
+        Scan a directory and add new or changed tracks to the library.
+        :param lib_path: directory to scan (default first library path)
+        :param is_demo: if True, tracks found are marked as demo tracks
+        """
         lib_path = lib_path or self.library_paths[0]
         LOG.debug(f"Starting library update of: {lib_path}")
-        for root, _, files in walk(lib_path):
-            album_art = None
-            if isfile(join(root, 'Folder.jpg')):
-                album_art = join(root, "Folder.jpg")
-            for file in files:
-                if file == 'Folder.jpg':
+        to_parse = list()
+        changed = False
+        debug = debug_enabled()
+        for root, entries in _scan_dir(lib_path):
+            album_art = next((entry.path for entry in entries
+                              if entry.name == 'Folder.jpg'), None)
+            for entry in entries:
+                file = entry.name
+                if file in self._ignored_files:
+                    if debug:
+                        LOG.debug(f"Ignoring file: {file}")
                     continue
-                elif file.startswith('.'):
-                    LOG.debug(f"Ignoring hidden file: {file}")
+                elif splitext(file)[1].lower() not in _AUDIO_EXTS:
+                    if debug:
+                        LOG.debug(f"Ignoring non-audio file: {file}")
                     continue
-                elif file in self._ignored_files:
-                    LOG.debug(f"Ignoring file: {file}")
+                abs_path = entry.path
+                try:
+                    file_stat = entry.stat()
+                except OSError as e:
+                    # e.g. a dangling symlink or a file removed mid-scan
+                    LOG.warning(f"Unable to read {abs_path}: {e}")
                     continue
-                elif not splitext(file)[1]:
-                    LOG.debug(f"Ignoring file with no extension: {file}")
+                song = self._songs.get(abs_path)
+                if song and (song.mtime, song.size) == \
+                        (file_stat.st_mtime, file_stat.st_size):
+                    if debug:
+                        LOG.debug(f"Ignoring already indexed track: "
+                                  f"{abs_path}")
+                    if song.is_demo != is_demo:
+                        song.is_demo = is_demo
+                        changed = True
                     continue
-                abs_path = join(root, file)
-                with self._update_lock:
-                    if abs_path in self._songs:
-                        LOG.debug(f"Ignoring already indexed track: {abs_path}")
-                        continue
-                    self._songs[abs_path] = \
-                        self._parse_track_from_file(abs_path, album_art)
+                to_parse.append((abs_path, album_art, file_stat))
+        songs = self._parse_tracks([p[0] for p in to_parse],
+                                   [p[1] for p in to_parse],
+                                   _AlbumArtCache())
+        with self._update_lock:
+            for (abs_path, _, file_stat), song in zip(to_parse, songs):
+                song.mtime = file_stat.st_mtime
+                song.size = file_stat.st_size
+                song.is_demo = is_demo
+                self._intern_fields(song)
+                if abs_path in self._songs:
+                    self._unindex_song(self._songs[abs_path])
+                self._songs[abs_path] = song
+                self._index_song(song)
+            if to_parse or changed:
+                self.generation += 1
         LOG.debug("Updated Library")
+        if to_parse or changed:
+            self._write_db()
+
+    def _write_db(self):
+        """
+        Write the library and its search index to the cache file, so the
+        index doesn't need to be rebuilt on load. The pickle is written to a
+        temporary file first so an interrupted write can't corrupt the
+        existing cache.
+        """
+        tmp_file = f"{self._db_file}.tmp"
         with self._update_lock:
             try:
-                with open(self._db_file, 'wb') as f:
-                    pickle.dump(self._songs, f)
+                # Buffer writes so each pickle frame isn't its own syscall
+                with open(tmp_file, 'wb', buffering=1 << 20) as f:
+                    f.write(_CACHE_HEADER)
+                    pickle.dump((self._songs, self._index), f, protocol=5)
+                replace(tmp_file, self._db_file)
             except Exception as e:
                 LOG.exception(e)
+                try:
+                    remove(tmp_file)
+                except FileNotFoundError:
+                    pass
 
-    def _parse_track_from_file(self, file_path: str,
-                               album_art: Optional[str] = None):
+    def _parse_tracks(self, files: List[str], album_art: List[Optional[str]],
+                      art_cache: Optional[_AlbumArtCache] = None) -> \
+            List[Track]:
+        """
+        Parse Tracks for a batch of files. Large batches are split across
+        worker processes since tag parsing is CPU-bound; on single-CPU hosts
+        a thread pool is used so that file reads still overlap.
+        :param files: list of audio file paths to parse
+        :param album_art: list of album art paths corresponding to `files`
+        :param art_cache: album art seen so far in this scan; worker
+            processes each start their own
+        :returns: list of parsed Tracks in the same order as `files`
+        """
+        if art_cache is None:
+            art_cache = _AlbumArtCache()
+        workers = cpu_count() or 1
+        if len(files) < self._min_parallel_files:
+            return self._parse_tracks_serial(files, album_art, art_cache)
+        if workers < 2:
+            LOG.info(f"Parsing {len(files)} files with threads")
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                return list(executor.map(self._parse_track_from_file,
+                                         files, album_art,
+                                         repeat(art_cache)))
+        workers = min(workers, self._max_parse_workers)
+        chunksize = max(1, min(64, len(files) // (workers * 4)))
+        # Don't start workers that would have no chunk to parse
+        workers = min(workers, -(-len(files) // chunksize))
+        LOG.info(f"Parsing {len(files)} files with {workers} processes")
         try:
-            meta = ovos_ocp_files_plugin.load(file_path)
-            image_bytes = meta.pictures[0].data if meta.pictures else None
-            album = meta.tags['album'][0]
-            artist = meta.tags['artist'][0]
-            genre = meta.tags['genre'][0] if 'genre' in meta.tags \
-                else None  # Handle missing genre tag
-            title = meta.tags['title'][0]
-            track_no = meta.tags['tracknumber'][0]
-            duration_seconds = round(meta.streaminfo['duration'])
-
-            if image_bytes:
-                filename = hashlib.md5(image_bytes).hexdigest()
-                album_art = self._write_album_art(image_bytes,
-                                                  filename)
-
-            if not isinstance(track_no, int):
-                # LOG.debug(f"Handling non-int track_no: {track_no}")
-                if track_no.isnumeric():
-                    track_no = int(track_no)
-                else:
-                    if track_no.split('/')[0].isnumeric():
-                        LOG.debug(f"Parsing track_no as int:"
-                                  f" {track_no}")
-                        track_no = int(track_no.split('/')[0])
-                    else:
-                        LOG.warning(f"Non-numeric track number:"
-                                    f" {track_no}")
-                        track_no = 0
-            song = Track(file_path, title, album, artist, genre,
-                         album_art, duration_seconds * 1000, track_no)
-            LOG.debug(song)
-            return song
-        except ovos_ocp_files_plugin.UnsupportedFormat as e:
-            LOG.warning(f"{file_path} unsupported by files plugin: {e}")
-            track = self._parse_id3_tags(file_path)
-        except KeyError as e:
-            LOG.error(e)
-            track = self._parse_id3_tags(file_path)
-
-        except Exception as e:
-            LOG.exception(f"{file_path} encountered error: {e}")
-            track = self._parse_id3_tags(file_path)
-
-        return track or self.song_from_file_path(file_path, album_art)
-
-    def _parse_id3_tags(self, file_path: str):
-        from id3parse import ID3
-        tag = ID3.from_file(file_path)
-        if tag:
-            data = dict()
-            for t in ('TPE1', 'TALB', 'TIT2', 'TRCK', 'TCON', 'TLEN'):
-                try:
-                    data[t] = tag.find_frame_by_name(t).text
-                except ValueError:
-                    LOG.debug(f"No tag: {t} for file: "
-                              f"{basename(file_path)}")
-                    data[t] = None
-            if not data.get('TIT2'):
-                return None
-            # TLEN is unreliable for track length, so let the player decide len
-            return Track(file_path, data.get('TIT2'), data.get('TALB'),
-                         data.get('TPE1'), data.get('TCON'),
-                         # duration_ms=round(float(data.get('TLEN') or 0)),
-                         track=data.get('TRCK'))
-
-    def _write_album_art(self, image_bytes: bytes, filename: str):
-        output_file = join(self.cache_path, f'{filename}.jpg')
-        if isfile(output_file):
-            return output_file
-        LOG.info(f"Wrote album art to: {output_file}")
-        with open(output_file, 'wb+') as f:
-            f.write(image_bytes)
-        return output_file
+            # Spawn workers rather than forking this multi-threaded process
+            with ProcessPoolExecutor(
+                    max_workers=workers, mp_context=get_context("spawn"),
+                    initializer=_init_parse_worker) as executor:
+                return list(executor.map(_parse_track_in_worker, files,
+                                         repeat(self.cache_path), album_art,
+                                         chunksize=chunksize))
+        except (BrokenProcessPool, OSError) as e:
+            # e.g. a worker was killed or `__main__` can't be re-imported
+            LOG.error(f"Parse workers failed, parsing serially: {e}")
+            return self._parse_tracks_serial(files, album_art, art_cache)
+
+    def _parse_tracks_serial(self, files: List[str],
+                             album_art: List[Optional[str]],
+                             art_cache: _AlbumArtCache) -> List[Track]:
+        return [self._parse_track_from_file(file, art, art_cache)
+                for file, art in zip(files, album_art)]
+
+    def _parse_track_from_file(self, file_path: str,
+                               album_art: Optional[str] = None,
+                               art_cache: Optional[_AlbumArtCache] = None) \
+            -> Track:
+        return _parse_track_from_file(file_path, self.cache_path, album_art,
+                                      art_cache)
+
+    @staticmethod
+    def _parse_id3_tags(file_path: str) -> Optional[Track]:
+        return _parse_id3_tags(file_path)
 
     @staticmethod
     def song_from_file_path(file: str, album_art: str = None) -> Track:
@@ -231,16 +680,12 @@ class MusicLibrary:
         Parse a song object from a file path. This expects the library to be
         structured: <Artist>/<Album>/<Track No> <Track Title>.<extension>
         """
-        album = basename(dirname(file))
-        artist = basename(dirname(dirname(file)))
-        if 'music' in {album.lower(), artist.lower()}:
-            LOG.warning(f"{file} not in an expected directory structure")
-            album, artist = None, None
+        album, artist = _album_and_artist(dirname(file))
         try:
             track, title = splitext(basename(file))[0].split(' ', 1)
             if not track.isnumeric():
-                track = 0
                 title = f'{track} {title}'
+                track = 0
             else:
                 track = int(track)
         except ValueError: